@@ -5,13 +5,12 @@ Z.AI API 配额查询工具
 """
 
 import os
+import re
 import sys
-import json
-import urllib.request
-import urllib.error
-import urllib.parse
-import argparse
-from datetime import datetime, timezone, timedelta
+import time
+import threading
+from collections import Counter
+from types import SimpleNamespace
 
 
 # ANSI 颜色代码
@@ -34,47 +33,279 @@ class Colors:
     GRAY_BAR = '\033[90m'
 
 
+# 每行都会用到的颜色，绑定为模块级名称以省去类属性查找
+GRAY_BAR = Colors.GRAY_BAR
+ENDC = Colors.ENDC
+
+# 进度条宽度，预先生成满宽度的字符串，绘制时只需切片
+BAR_WIDTH = 30
+FULL_BAR = '█' * BAR_WIDTH
+EMPTY_BAR = '░' * BAR_WIDTH
+
+# 标题和底部的分隔线
+SEPARATOR = '━' * 50
+
+# 按天/按小时消耗明细的行模板（使用量带千位分隔符）
+USAGE_ROW = "  {label}{pad} {bar} {usage:,}\n"
+
+# 终端中占 2 个宽度的字符：中文字符、中文标点等
+WIDE_CHARS = re.compile('[\u4e00-\u9fff（）：，。、；【】《》]')
+
+
+class FetchError(Exception):
+    """API 请求失败"""
+
+
+API_HOST = 'api.z.ai'
+API_BASE_URL = f'https://{API_HOST}'
+
+API_HEADERS = {
+    'accept': 'application/json, text/plain, */*',
+    'accept-language': 'en',
+    'origin': 'https://z.ai',
+    'referer': 'https://z.ai/',
+    'user-agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 18_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.5 Mobile/15E148 Safari/604.1'
+}
+
+# API 请求超时（秒），HTTP/2 与 urllib 两种请求方式共用
+REQUEST_TIMEOUT = 10
+
+# 响应缓存的默认有效期（秒）
+CACHE_TTL = 60
+
+# 命令行选项：开关选项和整数选项分别映射到参数名
+FLAG_OPTIONS = {
+    '-w': 'show_weekly', '--show-weekly': 'show_weekly',
+    '-H': 'show_hourly', '--show-hourly': 'show_hourly',
+    '--no-cache': 'no_cache',
+    '--refresh': 'refresh',
+}
+INT_OPTIONS = {
+    '-d': 'days', '--days': 'days',
+    '--hours': 'hours',
+    '--cache-ttl': 'cache_ttl',
+}
+LONG_OPTIONS = ['--help'] + [option for option in (*FLAG_OPTIONS, *INT_OPTIONS)
+                             if option.startswith('--')]
+
+USAGE_LINE = ('用法: zusage.py [-h] [-w] [-d DAYS] [-H] [--hours HOURS] '
+              '[--cache-ttl SECONDS] [--no-cache] [--refresh]')
+
+USAGE = f"""{USAGE_LINE}
+
+Z.AI API 配额查询工具
+
+选项:
+  -h, --help            显示帮助信息并退出
+  -w, --show-weekly     显示最近 7 天的 token 消耗详情
+  -d, --days DAYS       显示最近 N 天的消耗数据（默认: 7）
+  -H, --show-hourly     显示最近 8 小时的 token 消耗详情
+  --hours HOURS         显示最近 N 小时的消耗数据（默认: 8）
+  --cache-ttl SECONDS   响应缓存的有效期，单位秒（默认: {CACHE_TTL}）
+  --no-cache            不读取也不写入响应缓存
+  --refresh             忽略已有缓存，重新请求 API
+"""
+
+# JSON 解析函数，首次解析时才在 orjson 与标准库之间选择
+_json_loads = None
+
+# 共享的 HTTP/2 客户端：None 表示尚未创建，False 表示 httpx[http2] 不可用
+_http2_client = None
+_http2_client_lock = threading.Lock()
+
+
 def get_env_token():
-    """从环境变量读取 ZAI_TOKEN"""
-    token = os.environ.get('ZAI_TOKEN')
-    if not token:
-        print(f"{Colors.FAIL}错误: 未找到 ZAI_TOKEN 环境变量{Colors.ENDC}")
-        print(f"\n请设置环境变量:")
-        print(f"  export ZAI_TOKEN=\"your-token-here\"")
-        print(f"\n或者添加到 ~/.bashrc 或 ~/.zshrc:")
-        print(f"  echo 'export ZAI_TOKEN=\"your-token-here\"' >> ~/.bashrc")
-        sys.exit(1)
-    return token
+    """从环境变量读取 ZAI_TOKEN，未设置时返回 None"""
+    return os.environ.get('ZAI_TOKEN') or None
 
 
-def fetch_quota_data(token):
-    """从 API 获取配额数据"""
-    url = 'https://api.z.ai/api/monitor/usage/quota/limit'
+def format_missing_token():
+    """生成未设置 ZAI_TOKEN 时的提示"""
+    return (f"{Colors.FAIL}错误: 未找到 ZAI_TOKEN 环境变量{Colors.ENDC}\n"
+            f"\n请设置环境变量:\n"
+            f"  export ZAI_TOKEN=\"your-token-here\"\n"
+            f"\n或者添加到 ~/.bashrc 或 ~/.zshrc:\n"
+            f"  echo 'export ZAI_TOKEN=\"your-token-here\"' >> ~/.bashrc\n")
+
+
+def format_error(message):
+    """生成错误提示"""
+    return f"{Colors.FAIL}错误: {message}{Colors.ENDC}\n"
+
+
+def get_http2_client():
+    """返回共享的 HTTP/2 客户端，未安装 httpx[http2] 时返回 None"""
+    global _http2_client
+    if _http2_client is None:
+        # 导入放在锁外，http2=True 还需要 h2
+        try:
+            import h2  # noqa: F401
+            import httpx
+        except ImportError:
+            httpx = None
+
+        with _http2_client_lock:
+            if _http2_client is None:
+                if httpx is None:
+                    _http2_client = False
+                else:
+                    _http2_client = httpx.Client(http2=True, base_url=API_BASE_URL,
+                                                 timeout=REQUEST_TIMEOUT)
+    return _http2_client or None
+
 
-    headers = {
-        'accept': 'application/json, text/plain, */*',
-        'accept-language': 'en',
-        'authorization': f'Bearer {token}',
-        'origin': 'https://z.ai',
-        'referer': 'https://z.ai/',
-        'user-agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 18_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.5 Mobile/15E148 Safari/604.1'
-    }
+def request_body_http2(client, path, headers):
+    """通过 HTTP/2 客户端发送 GET 请求，并发请求复用同一连接"""
+    import httpx
 
-    req = urllib.request.Request(url, headers=headers)
+    try:
+        response = client.get(path, headers=headers)
+    except httpx.TimeoutException as e:
+        raise FetchError("请求超时") from e
+    except httpx.HTTPError as e:
+        raise FetchError(f"无法连接到服务器 - {e}") from e
+
+    if response.status_code != 200:
+        raise FetchError(f"HTTP {response.status_code} - {response.reason_phrase}")
+    return response.content
+
+
+def request_body(path, token):
+    """发送 GET 请求并返回原始响应体，失败时抛出 FetchError
 
+    安装了 httpx[http2] 时使用 HTTP/2 多路复用，否则使用 urllib
+    """
+    headers = dict(API_HEADERS, authorization=f'Bearer {token}')
+
+    client = get_http2_client()
+    if client is not None:
+        return request_body_http2(client, path, headers)
+
+    import http.client
+    import socket
+    import urllib.error
+    import urllib.request
+
+    req = urllib.request.Request(f'{API_BASE_URL}{path}', headers=headers)
     try:
-        with urllib.request.urlopen(req) as response:
-            data = response.read().decode('utf-8')
-            return json.loads(data)
+        with urllib.request.urlopen(req, timeout=REQUEST_TIMEOUT) as response:
+            return response.read()
     except urllib.error.HTTPError as e:
-        print(f"{Colors.FAIL}错误: HTTP {e.code} - {e.reason}{Colors.ENDC}")
-        sys.exit(1)
+        raise FetchError(f"HTTP {e.code} - {e.reason}") from e
     except urllib.error.URLError as e:
-        print(f"{Colors.FAIL}错误: 无法连接到服务器 - {e.reason}{Colors.ENDC}")
-        sys.exit(1)
-    except json.JSONDecodeError as e:
-        print(f"{Colors.FAIL}错误: 无法解析 API 响应 - {e}{Colors.ENDC}")
-        sys.exit(1)
+        raise FetchError(f"无法连接到服务器 - {e.reason}") from e
+    # 等待响应头或读取响应体时的错误不会被包装成 URLError
+    except socket.timeout as e:
+        raise FetchError("请求超时") from e
+    except (OSError, http.client.HTTPException) as e:
+        raise FetchError(f"无法连接到服务器 - {e}") from e
+
+
+def json_loads(data):
+    """直接从字节解析 JSON，优先使用 orjson，未安装时回退到标准库
+
+    导入推迟到首次调用：orjson 会连带导入 datetime，缺少 token 等快速退出路径无需这些开销
+    """
+    global _json_loads
+    if _json_loads is None:
+        try:
+            from orjson import loads
+        except ImportError:
+            from json import loads
+        _json_loads = loads
+    return _json_loads(data)
+
+
+def parse_body(body):
+    """直接从字节解析 JSON 响应，失败时抛出 FetchError"""
+    try:
+        return json_loads(body)
+    # UnicodeDecodeError 以及 json/orjson 的 JSONDecodeError 都是 ValueError
+    except ValueError as e:
+        raise FetchError(f"无法解析 API 响应 - {e}") from e
+
+
+def get_cache_path(kind, token, *params):
+    """返回缓存文件路径，文件名由 token 及请求参数的哈希构成"""
+    import hashlib
+
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    key = hashlib.sha256('\0'.join((token,) + params).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_home, 'zusage', f'{kind}-{key}.json')
+
+
+def read_cache(path, ttl):
+    """读取未过期的缓存，不存在、已过期或损坏时返回 None"""
+    try:
+        if time.time() - os.path.getmtime(path) >= ttl:
+            return None
+        with open(path, 'rb') as f:
+            return json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(path, body):
+    """将原始响应体原子地写入缓存，写入失败时静默忽略"""
+    import tempfile
+
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass
+
+
+def prune_cache(cache_dir, ttl):
+    """删除缓存目录中已过期的文件，避免缓存无限增长"""
+    now = time.time()
+    try:
+        entries = os.scandir(cache_dir)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if not entry.name.endswith(('.json', '.tmp')):
+                continue
+            try:
+                if now - entry.stat().st_mtime >= ttl:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+def cached_request(cache_path, fetch, cache_ttl, refresh):
+    """优先返回有效缓存，否则调用 fetch 获取响应体，解析并缓存成功的响应
+
+    cache_ttl <= 0 时完全禁用缓存；refresh 为 True 时跳过读取但仍写入缓存
+    """
+    if cache_ttl > 0 and not refresh:
+        data = read_cache(cache_path, cache_ttl)
+        if data is not None:
+            return data
+
+    body = fetch()
+    data = parse_body(body)
+    # 直接缓存原始字节，无需重新序列化
+    if cache_ttl > 0 and isinstance(data, dict) and data.get('success'):
+        write_cache(cache_path, body)
+        prune_cache(os.path.dirname(cache_path), cache_ttl)
+    return data
+
+
+def fetch_quota_data(token, cache_ttl=CACHE_TTL, refresh=False):
+    """从 API 获取配额数据"""
+    return cached_request(
+        get_cache_path('quota', token),
+        lambda: request_body('/api/monitor/usage/quota/limit', token),
+        cache_ttl, refresh)
 
 
 def format_number(num):
@@ -102,18 +333,24 @@ def get_percentage_color(percentage):
         return Colors.FAIL
 
 
-def create_progress_bar(percentage, width=30):
+def render_bar(color, filled, width=BAR_WIDTH):
+    """绘制已填充 filled 格、总宽 width 格的进度条"""
+    if 0 <= filled <= width <= BAR_WIDTH:
+        return f"{color}{FULL_BAR[:filled]}{GRAY_BAR}{EMPTY_BAR[:width - filled]}{ENDC}"
+    return f"{color}{'█' * filled}{GRAY_BAR}{'░' * (width - filled)}{ENDC}"
+
+
+def create_progress_bar(percentage, width=BAR_WIDTH):
     """创建进度条"""
     filled = int(width * percentage / 100)
-    empty = width - filled
     color = get_progress_bar_color(percentage)
-
-    bar = color + '█' * filled + Colors.GRAY_BAR + '░' * empty + Colors.ENDC
-    return bar
+    return render_bar(color, filled, width)
 
 
 def format_timestamp(ms_timestamp):
     """将 Unix 毫秒时间戳转换为可读时间"""
+    from datetime import datetime, timezone
+
     # 将毫秒转换为秒
     timestamp = ms_timestamp / 1000
     # 转换为 datetime 对象（UTC）
@@ -128,7 +365,7 @@ def calculate_time_remaining(reset_timestamp):
     """计算距离重置的剩余时间"""
     # 将毫秒转换为秒
     reset_time = reset_timestamp / 1000
-    now = datetime.now(timezone.utc).timestamp()
+    now = time.time()
 
     remaining_seconds = reset_time - now
 
@@ -171,17 +408,16 @@ def extract_usage_details(data):
         return []
 
 
-def print_header():
-    """打印标题"""
-    print(f"\n{Colors.OKCYAN}{Colors.BOLD}🤖 Z.AI API 配额使用情况{Colors.ENDC}")
-    print(f"{Colors.OKCYAN}{'━' * 50}{Colors.ENDC}\n")
+def format_header():
+    """生成标题"""
+    return (f"\n{Colors.OKCYAN}{Colors.BOLD}🤖 Z.AI API 配额使用情况{Colors.ENDC}\n"
+            f"{Colors.OKCYAN}{SEPARATOR}{Colors.ENDC}\n\n")
 
 
-def print_token_usage(token_data):
-    """打印 token 使用情况"""
+def format_token_usage(token_data):
+    """生成 token 使用情况"""
     if not token_data:
-        print(f"{Colors.WARNING}未找到 token 使用数据{Colors.ENDC}")
-        return
+        return f"{Colors.WARNING}未找到 token 使用数据{Colors.ENDC}\n"
 
     percentage = token_data.get('percentage', 0)
     current_value = token_data.get('currentValue', 0)
@@ -190,7 +426,7 @@ def print_token_usage(token_data):
     reset_time = token_data.get('nextResetTime', 0)
 
     # Token 使用情况标题
-    print(f"{Colors.OKBLUE}{Colors.BOLD}📊 Token 使用情况:{Colors.ENDC}")
+    lines = [f"{Colors.OKBLUE}{Colors.BOLD}📊 Token 使用情况:{Colors.ENDC}\n"]
 
     # 进度条和百分比
     progress_bar = create_progress_bar(percentage)
@@ -198,76 +434,68 @@ def print_token_usage(token_data):
 
     # 检查是否有具体的数值数据
     if current_value > 0 or total > 0:
-        print(f"  已使用: {progress_bar} {percentage_color}{percentage}%{Colors.ENDC} "
-              f"({format_number(current_value)} / {format_number(total)})")
+        lines.append(f"  已使用: {progress_bar} {percentage_color}{percentage}%{Colors.ENDC} "
+                     f"({format_number(current_value)} / {format_number(total)})\n")
     else:
         # 新 API 格式：只有百分比，没有具体数值
-        print(f"  使用率: {progress_bar} {percentage_color}{percentage}%{Colors.ENDC}")
+        lines.append(f"  使用率: {progress_bar} {percentage_color}{percentage}%{Colors.ENDC}\n")
 
     # 剩余量（如果有）
     if remaining > 0:
-        print(f"  剩余: {format_number(remaining)} tokens")
+        lines.append(f"  剩余: {format_number(remaining)} tokens\n")
     else:
-        print()
+        lines.append("\n")
 
     # 重置时间
     if reset_time:
         formatted_time = format_timestamp(reset_time)
         time_remaining = calculate_time_remaining(reset_time)
-        print(f"{Colors.OKBLUE}{Colors.BOLD}⏰ 下次重置:{Colors.ENDC} {formatted_time}")
-        print(f"  {Colors.OKCYAN}({time_remaining}){Colors.ENDC}\n")
+        lines.append(f"{Colors.OKBLUE}{Colors.BOLD}⏰ 下次重置:{Colors.ENDC} {formatted_time}\n")
+        lines.append(f"  {Colors.OKCYAN}({time_remaining}){Colors.ENDC}\n\n")
+
+    return ''.join(lines)
 
 
-def print_service_usage(usage_details):
-    """打印各服务使用详情"""
+def format_service_usage(usage_details):
+    """生成各服务使用详情"""
     if not usage_details:
-        return
+        return ''
 
-    print(f"{Colors.OKBLUE}{Colors.BOLD}📈 各服务使用详情:{Colors.ENDC}")
+    lines = [f"{Colors.OKBLUE}{Colors.BOLD}📈 各服务使用详情:{Colors.ENDC}\n"]
     for detail in usage_details:
         model = detail.get('modelCode', 'unknown')
         usage = detail.get('usage', 0)
-        print(f"  • {model:<15} {format_number(usage)} tokens")
-    print()
+        lines.append(f"  • {model:<15} {format_number(usage)} tokens\n")
+    lines.append("\n")
+    return ''.join(lines)
 
 
-def print_footer():
-    """打印底部"""
-    print(f"{Colors.OKCYAN}{'━' * 50}{Colors.ENDC}\n")
+def format_footer():
+    """生成底部"""
+    return f"{Colors.OKCYAN}{SEPARATOR}{Colors.ENDC}\n\n"
 
 
-def fetch_usage_data(token, start_time, end_time):
+def fetch_usage_data(token, start_time, end_time, cache_ttl=CACHE_TTL, refresh=False):
     """从 API 获取使用统计数据"""
+    import urllib.parse
+
     # URL 编码参数
     params = urllib.parse.urlencode({
         'startTime': start_time,
         'endTime': end_time
     })
-    url = f'https://api.z.ai/api/monitor/usage/model-usage?{params}'
+    return cached_request(
+        get_cache_path('usage', token, start_time, end_time),
+        lambda: request_body(f'/api/monitor/usage/model-usage?{params}', token),
+        cache_ttl, refresh)
 
-    headers = {
-        'accept': 'application/json, text/plain, */*',
-        'accept-language': 'en',
-        'authorization': f'Bearer {token}',
-        'origin': 'https://z.ai',
-        'referer': 'https://z.ai/',
-        'user-agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 18_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.5 Mobile/15E148 Safari/604.1'
-    }
-
-    req = urllib.request.Request(url, headers=headers)
 
+def get_usage_result(future, out):
+    """获取使用统计请求的结果，失败时将错误追加到 out 并返回 None"""
     try:
-        with urllib.request.urlopen(req) as response:
-            data = response.read().decode('utf-8')
-            return json.loads(data)
-    except urllib.error.HTTPError as e:
-        print(f"{Colors.FAIL}错误: HTTP {e.code} - {e.reason}{Colors.ENDC}")
-        return None
-    except urllib.error.URLError as e:
-        print(f"{Colors.FAIL}错误: 无法连接到服务器 - {e.reason}{Colors.ENDC}")
-        return None
-    except json.JSONDecodeError as e:
-        print(f"{Colors.FAIL}错误: 无法解析 API 响应 - {e}{Colors.ENDC}")
+        return future.result()
+    except FetchError as e:
+        out.append(format_error(e))
         return None
 
 
@@ -281,20 +509,15 @@ def aggregate_daily_usage(data):
         tokens_usage = data.get('data', {}).get('tokensUsage', [])
         total_usage = data.get('data', {}).get('totalUsage', {})
 
-        # 按日期聚合
-        daily_totals = {}
-        for i, time_str in enumerate(x_times):
-            # 提取日期部分 (YYYY-MM-DD)
-            date_str = time_str.split(' ')[0]
-            token_value = tokens_usage[i]
-
+        # 按日期聚合，time_str[:10] 为日期部分 (YYYY-MM-DD)
+        daily_totals = Counter()
+        for time_str, token_value in zip(x_times, tokens_usage):
             if token_value is not None:
-                if date_str not in daily_totals:
-                    daily_totals[date_str] = 0
-                daily_totals[date_str] += token_value
+                daily_totals[time_str[:10]] += token_value
 
         return {
             'daily': daily_totals,
+            'max': max(daily_totals.values(), default=0),
             'total': total_usage.get('totalTokensUsage', 0)
         }
     except (AttributeError, TypeError):
@@ -303,26 +526,18 @@ def aggregate_daily_usage(data):
 
 def get_today_date():
     """获取今天的日期字符串（本地时间）"""
-    return datetime.now().strftime('%Y-%m-%d')
+    return time.strftime('%Y-%m-%d')
 
 
 def get_display_width(text):
     """计算字符串在终端中的实际显示宽度（中文=2，英文=1）"""
-    width = 0
-    for char in text:
-        # 中文字符、中文标点等占用2个宽度
-        if '\u4e00' <= char <= '\u9fff' or char in '（）：，。、；''""【】《》':
-            width += 2
-        else:
-            width += 1
-    return width
+    return len(text) + len(WIDE_CHARS.findall(text))
 
 
-def print_daily_usage_summary(usage_data):
-    """打印今日和历史总计使用量"""
+def format_daily_usage_summary(usage_data):
+    """生成今日和历史总计使用量"""
     if not usage_data:
-        print(f"{Colors.WARNING}📈 消耗统计: 暂无数据{Colors.ENDC}\n")
-        return
+        return f"{Colors.WARNING}📈 消耗统计: 暂无数据{Colors.ENDC}\n\n"
 
     today = get_today_date()
     daily = usage_data.get('daily', {})
@@ -330,76 +545,64 @@ def print_daily_usage_summary(usage_data):
 
     today_usage = daily.get(today, 0)
 
-    print(f"{Colors.OKBLUE}{Colors.BOLD}📈 消耗统计:{Colors.ENDC}")
-    print(f"  今日已用: {format_number(today_usage)} tokens")
-    print(f"  历史总计: {format_number(total)} tokens\n")
+    return (f"{Colors.OKBLUE}{Colors.BOLD}📈 消耗统计:{Colors.ENDC}\n"
+            f"  今日已用: {format_number(today_usage)} tokens\n"
+            f"  历史总计: {format_number(total)} tokens\n\n")
 
 
-def print_weekly_usage(usage_data, days=7):
-    """打印最近 N 天的使用情况"""
+def format_weekly_usage(usage_data, days=7):
+    """生成最近 N 天的使用情况"""
+    from datetime import date, timedelta
+
     if not usage_data:
-        return
+        return ''
 
     daily = usage_data.get('daily', {})
-    if not daily:
-        return
 
-    # 获取最近 N 天的日期列表（倒序）
-    today = datetime.now()
-    date_list = []
-    for i in range(days):
-        date = today - timedelta(days=i)
-        date_str = date.strftime('%Y-%m-%d')
-        date_list.append((date_str, date))
+    # 最大值用于进度条比例，聚合时已算出
+    max_usage = usage_data.get('max')
+    if max_usage is None:
+        max_usage = max(daily.values(), default=0)
 
-    # 找出最大值用于进度条比例
-    max_usage = max(daily.values()) if daily else 1
+    # 没有任何消耗时无需逐行绘制（API 对无消耗的时段返回 None，daily 可能为空）
     if max_usage == 0:
-        max_usage = 1
+        return f"{Colors.WARNING}📅 最近 {days} 天消耗: 暂无消耗{Colors.ENDC}\n\n"
+
+    # 获取最近 N 天的日期列表（倒序）
+    today = date.today()
+    date_list = [today - timedelta(days=i) for i in range(days)]
+    date_strs = [d.isoformat() for d in date_list]
 
     # 生成所有标签并找出最大宽度
-    labels = []
-    for i, (date_str, date) in enumerate(date_list):
-        if i == 0:
-            label = f"{date_str} (今天)"
-        elif i == 1:
-            label = f"{date_str} (昨天)"
-        else:
-            weekday = date.strftime('%a')
-            label = f"{date_str} ({weekday})"
-        labels.append(label)
+    suffixes = ['今天', '昨天'] + [d.strftime('%a') for d in date_list[2:]]
+    labels = [f"{date_str} ({suffix})" for date_str, suffix in zip(date_strs, suffixes)]
 
     max_label_width = max(get_display_width(label) for label in labels) if labels else 0
 
-    print(f"{Colors.OKBLUE}{Colors.BOLD}📅 最近 {days} 天消耗:{Colors.ENDC}")
-
-    for i, (date_str, date) in enumerate(date_list):
+    rows = [f"{Colors.OKBLUE}{Colors.BOLD}📅 最近 {days} 天消耗:{Colors.ENDC}\n"]
+    bar_color = Colors.OKGREEN
+    format_row = USAGE_ROW.format
+    for date_str, label in zip(date_strs, labels):
         usage = daily.get(date_str, 0)
 
-        label = labels[i]
-
         # 创建进度条（相对最大值）
-        if max_usage > 0:
-            bar_width = int(30 * usage / max_usage)
-        else:
-            bar_width = 0
+        bar_width = int(BAR_WIDTH * usage / max_usage)
 
-        progress_bar = Colors.OKGREEN + '█' * bar_width + Colors.GRAY_BAR + '░' * (30 - bar_width) + Colors.ENDC
-
-        # 格式化使用量（带千位分隔符）
-        usage_str = format_number(usage)
+        progress_bar = render_bar(bar_color, bar_width)
 
         # 计算需要的空格数来对齐（使用最大标签宽度）
         label_width = get_display_width(label)
-        padding = max_label_width - label_width
-        padding_str = ' ' * padding
+        padding_str = ' ' * (max_label_width - label_width)
 
-        print(f"  {label}{padding_str} {progress_bar} {usage_str}")
-    print()
+        rows.append(format_row(label=label, pad=padding_str, bar=progress_bar, usage=usage))
+    rows.append('\n')
+    return ''.join(rows)
 
 
 def aggregate_hourly_usage(data, hours=8):
     """聚合最近 N 小时的使用数据"""
+    from datetime import datetime, timedelta
+
     if not data or not data.get('success'):
         return None
 
@@ -409,10 +612,14 @@ def aggregate_hourly_usage(data, hours=8):
 
         # 获取当前时间（本地时间）
         now = datetime.now()
+        # 与 -w 共用请求时数据覆盖多天，先用字符串比较跳过窗口外的时间点，省去逐个 strptime
+        cutoff = (now - timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M')
 
         # 按小时聚合
         hourly_totals = {}
         for i, time_str in enumerate(x_times):
+            if time_str < cutoff:
+                continue
             # 解析时间字符串 "YYYY-MM-DD HH:MM"
             dt = datetime.strptime(time_str, '%Y-%m-%d %H:%M')
             token_value = tokens_usage[i]
@@ -431,18 +638,18 @@ def aggregate_hourly_usage(data, hours=8):
         return None
 
 
-def print_hourly_usage(hourly_data, hours=8):
-    """打印最近 N 小时的使用情况"""
+def format_hourly_usage(hourly_data, hours=8):
+    """生成最近 N 小时的使用情况"""
+    from datetime import datetime, timedelta
+
     if not hourly_data:
-        return
+        return ''
 
     # 找出最大值用于进度条比例
     max_usage = max(hourly_data.values()) if hourly_data else 1
     if max_usage == 0:
         max_usage = 1
 
-    print(f"{Colors.OKBLUE}{Colors.BOLD}⏰ 最近 {hours} 小时消耗:{Colors.ENDC}")
-
     # 生成最近 N 小时的列表（倒序）
     now = datetime.now()
     hour_list = []
@@ -464,6 +671,9 @@ def print_hourly_usage(hourly_data, hours=8):
 
     max_label_width = max(get_display_width(label) for label in labels) if labels else 0
 
+    rows = [f"{Colors.OKBLUE}{Colors.BOLD}⏰ 最近 {hours} 小时消耗:{Colors.ENDC}\n"]
+    bar_color = Colors.OKGREEN
+    format_row = USAGE_ROW.format
     for idx, (hour_key, hour_time) in enumerate(hour_list):
         usage = hourly_data.get(hour_key, 0)
 
@@ -471,101 +681,183 @@ def print_hourly_usage(hourly_data, hours=8):
 
         # 创建进度条（相对最大值）
         if max_usage > 0:
-            bar_width = int(30 * usage / max_usage)
+            bar_width = int(BAR_WIDTH * usage / max_usage)
         else:
             bar_width = 0
 
-        progress_bar = Colors.OKGREEN + '█' * bar_width + Colors.GRAY_BAR + '░' * (30 - bar_width) + Colors.ENDC
-
-        # 格式化使用量（带千位分隔符）
-        usage_str = format_number(usage)
+        progress_bar = render_bar(bar_color, bar_width)
 
         # 计算需要的空格数来对齐（使用最大标签宽度）
         label_width = get_display_width(label)
-        padding = max_label_width - label_width
-        padding_str = ' ' * padding
-
-        print(f"  {label}{padding_str} {progress_bar} {usage_str}")
-    print()
+        padding_str = ' ' * (max_label_width - label_width)
 
+        rows.append(format_row(label=label, pad=padding_str, bar=progress_bar, usage=usage))
+    rows.append('\n')
+    return ''.join(rows)
 
-def main():
-    """主函数"""
-    # 解析命令行参数
-    parser = argparse.ArgumentParser(description='Z.AI API 配额查询工具')
-    parser.add_argument('-w', '--show-weekly', action='store_true',
-                        help='显示最近 7 天的 token 消耗详情')
-    parser.add_argument('-d', '--days', type=int, default=7,
-                        help='显示最近 N 天的消耗数据（默认: 7）')
-    parser.add_argument('-H', '--show-hourly', action='store_true',
-                        help='显示最近 8 小时的 token 消耗详情')
-    parser.add_argument('--hours', type=int, default=8,
-                        help='显示最近 N 小时的消耗数据（默认: 8）')
-    args = parser.parse_args()
-
-    # 打印标题
-    print_header()
 
+def run(args, out):
+    """查询 API 并将输出追加到 out"""
     # 获取 token
     token = get_env_token()
+    if not token:
+        out.append(format_missing_token())
+        sys.exit(1)
+
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime, timedelta
 
-    # 获取配额数据
-    data = fetch_quota_data(token)
+    cache_ttl = 0 if args.no_cache else args.cache_ttl
+
+    # 计算使用统计的查询时间范围（最近 N 天 / 最近 N 小时）
+    now = datetime.now()
+    days_to_fetch = args.days
+    daily_start = (now - timedelta(days=days_to_fetch - 1)).strftime('%Y-%m-%d') + ' 00:00:00'
+    daily_end = now.strftime('%Y-%m-%d') + ' 23:59:59'
+
+    # 获取小时级别的数据（最近24小时以覆盖请求的小时数）
+    # 精确到分钟，使同一分钟内的重复查询可以命中缓存
+    hours_to_fetch = max(args.hours, 24)
+    hourly_start = (now - timedelta(hours=hours_to_fetch)).strftime('%Y-%m-%d %H:%M:00')
+    hourly_end = now.strftime('%Y-%m-%d %H:%M:00')
+
+    # 按天的查询范围已覆盖按小时的范围时，两个视图共用一次请求
+    share_usage = args.show_weekly and args.show_hourly and daily_start <= hourly_start
+
+    # 各请求相互独立，并发发出以重叠网络延迟
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        quota_future = executor.submit(fetch_quota_data, token, cache_ttl, args.refresh)
+        daily_future = None
+        hourly_future = None
+        # 只有在指定了显示选项时才获取使用统计数据
+        if args.show_weekly:
+            daily_future = executor.submit(fetch_usage_data, token, daily_start, daily_end,
+                                           cache_ttl, args.refresh)
+        if share_usage:
+            hourly_future = daily_future
+        elif args.show_hourly:
+            hourly_future = executor.submit(fetch_usage_data, token, hourly_start, hourly_end,
+                                            cache_ttl, args.refresh)
+
+    # 所有请求完成后再统一处理错误，避免一个失败中断其他请求
+    try:
+        data = quota_future.result()
+    except FetchError as e:
+        out.append(format_error(e))
+        sys.exit(1)
 
     # 检查响应是否成功
     if not data.get('success'):
-        print(f"{Colors.FAIL}错误: API 返回失败{Colors.ENDC}")
+        out.append(format_error('API 返回失败'))
         if 'msg' in data:
-            print(f"消息: {data['msg']}")
+            out.append(f"消息: {data['msg']}\n")
         sys.exit(1)
 
     # 提取并显示 token 使用情况
     token_data = extract_token_data(data)
-    print_token_usage(token_data)
+    out.append(format_token_usage(token_data))
 
     # 提取并显示各服务使用详情
     usage_details = extract_usage_details(data)
-    print_service_usage(usage_details)
-
-    # 只有在指定了显示选项时才获取使用统计数据
-    if args.show_weekly or args.show_hourly:
-        # 获取使用统计数据（最近 N 天）
-        days_to_fetch = args.days
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days_to_fetch - 1)
+    out.append(format_service_usage(usage_details))
 
-        start_time_str = start_date.strftime('%Y-%m-%d') + ' 00:00:00'
-        end_time_str = end_date.strftime('%Y-%m-%d') + ' 23:59:59'
-
-        usage_data_response = fetch_usage_data(token, start_time_str, end_time_str)
+    # 如果指定了 --show-weekly，显示今日和总计以及最近 N 天详情
+    if daily_future:
+        usage_data_response = get_usage_result(daily_future, out)
         aggregated_usage = aggregate_daily_usage(usage_data_response)
 
-        # 显示今日和总计（仅当显示周视图时）
-        if args.show_weekly:
-            print_daily_usage_summary(aggregated_usage)
-
-        # 如果指定了 --show-weekly，显示最近 N 天详情
-        if args.show_weekly and aggregated_usage:
-            print_weekly_usage(aggregated_usage, days=args.days)
+        out.append(format_daily_usage_summary(aggregated_usage))
+        if aggregated_usage:
+            out.append(format_weekly_usage(aggregated_usage, days=args.days))
 
     # 如果指定了 --show-hourly，显示最近 N 小时详情
-    if args.show_hourly:
-        # 获取小时级别的数据（最近24小时以覆盖请求的小时数）
-        hours_to_fetch = max(args.hours, 24)
-        end_date = datetime.now()
-        start_date = end_date - timedelta(hours=hours_to_fetch)
-
-        start_time_str = start_date.strftime('%Y-%m-%d %H:%M:%S')
-        end_time_str = end_date.strftime('%Y-%m-%d %H:%M:%S')
-
-        hourly_data_response = fetch_usage_data(token, start_time_str, end_time_str)
+    if hourly_future:
+        if share_usage:
+            hourly_data_response = usage_data_response
+        else:
+            hourly_data_response = get_usage_result(hourly_future, out)
         aggregated_hourly = aggregate_hourly_usage(hourly_data_response, hours=args.hours)
 
         if aggregated_hourly:
-            print_hourly_usage(aggregated_hourly, hours=args.hours)
+            out.append(format_hourly_usage(aggregated_hourly, hours=args.hours))
+
+    # 底部
+    out.append(format_footer())
+
+
+def usage_error(message):
+    """打印用法错误并以状态码 2 退出"""
+    sys.stderr.write(f"{USAGE_LINE}\nzusage.py: 错误: {message}\n")
+    sys.exit(2)
+
+
+def expand_long_option(name):
+    """将长选项的唯一前缀（如 --day）展开为完整的选项名"""
+    if name in LONG_OPTIONS:
+        return name
+    matches = [option for option in LONG_OPTIONS if option.startswith(name)]
+    if len(matches) > 1:
+        usage_error(f"有歧义的参数: {name} 可匹配 {', '.join(matches)}")
+    return matches[0] if matches else name
+
+
+def parse_args(argv):
+    """解析命令行参数（选项很少，手工解析以省去导入 argparse 的开销）"""
+    args = SimpleNamespace(show_weekly=False, days=7, show_hourly=False, hours=8,
+                           cache_ttl=CACHE_TTL, no_cache=False, refresh=False)
+
+    argv = list(argv)
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+
+        if arg.startswith('--'):
+            name, has_value, value = arg.partition('=')
+            name = expand_long_option(name)
+        elif arg.startswith('-') and len(arg) > 2:
+            # 合并的短选项：-wH、-d7 或 -wd7，整数选项之后的部分都是它的值
+            if arg[:2] in INT_OPTIONS:
+                name, has_value, value = arg[:2], True, arg[2:]
+            else:
+                argv.insert(i, f'-{arg[2:]}')
+                name, has_value, value = arg[:2], False, ''
+        else:
+            name, has_value, value = arg, False, ''
+
+        if name in ('-h', '--help') and not has_value:
+            sys.stdout.write(USAGE)
+            sys.exit(0)
+        elif name in FLAG_OPTIONS and not has_value:
+            setattr(args, FLAG_OPTIONS[name], True)
+        elif name in INT_OPTIONS:
+            if not has_value:
+                if i >= len(argv):
+                    usage_error(f"参数 {name}: 需要一个整数")
+                value = argv[i]
+                i += 1
+            try:
+                setattr(args, INT_OPTIONS[name], int(value))
+            except ValueError:
+                usage_error(f"参数 {name}: 无效的整数: '{value}'")
+        else:
+            usage_error(f"无法识别的参数: {arg}")
 
-    # 打印底部
-    print_footer()
+    return args
+
+
+def main():
+    """主函数"""
+    # 解析命令行参数
+    args = parse_args(sys.argv[1:])
+
+    # 所有输出先收集起来，结束时一次性写出
+    out = [format_header()]
+    try:
+        run(args, out)
+    finally:
+        sys.stdout.write(''.join(out))
+        sys.stdout.flush()
 
 
 if __name__ == '__main__':